@@ -1,12 +1,90 @@
 import sys
-import whisper
-import pyaudio
+import os
+import functools
+import ctypes
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+import sounddevice as sd
 import numpy as np
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
-                            QPushButton, QTextEdit, QLabel, QComboBox, QSpinBox)
-from PyQt5.QtCore import QThread, pyqtSignal
+                            QPushButton, QPlainTextEdit, QLabel, QComboBox, QSpinBox)
+from PyQt5.QtCore import QThread, QTimer, pyqtSignal
 import queue
-import time
+from collections import deque
+
+SAMPLE_RATE = 16000  # Whisper and Silero VAD both expect 16 kHz mono audio
+
+def _split_cores():
+    """Split the process's CPU cores: the first two go to the audio callback and GUI, the rest to inference"""
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(os.getpid()))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    if len(cores) <= 2:
+        return cores, cores
+    return cores[:2], cores[2:]
+
+# Computed once at import, before any thread narrows its own affinity
+_AUDIO_CORES, _INFERENCE_CORES = _split_cores()
+
+def _pin_to_cores(cores):
+    """Pin the calling thread (and the threads it spawns) to the given cores on Linux"""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+def _raise_thread_priority():
+    """Best-effort real-time priority for the calling thread"""
+    try:
+        if hasattr(os, "sched_setscheduler"):
+            # Linux: pid 0 targets the calling thread only
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(20))
+        elif sys.platform == "win32":
+            kernel32 = ctypes.windll.kernel32
+            THREAD_PRIORITY_TIME_CRITICAL = 15
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_PRIORITY_TIME_CRITICAL)
+    except OSError:
+        pass  # Requires elevated privileges (e.g. CAP_SYS_NICE); keep the default priority
+
+@functools.lru_cache(maxsize=1)
+def _get_model(name="base.en"):
+    """Load a Whisper model once and share it across transcription threads"""
+    return WhisperModel(
+        name,
+        device="cpu",
+        compute_type="int8",
+        cpu_threads=len(_INFERENCE_CORES)
+    )
+
+@functools.lru_cache(maxsize=1)
+def _get_pipeline(name="base.en"):
+    return BatchedInferencePipeline(model=_get_model(name))
+
+class ModelWarmupThread(QThread):
+    """Loads the Whisper model off the GUI thread and runs one throwaway transcription"""
+    ready_signal = pyqtSignal()
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, model_name):
+        super().__init__()
+        self.model_name = model_name
+
+    def run(self):
+        try:
+            # CTranslate2 creates its worker threads on load, so they inherit this affinity
+            _pin_to_cores(_INFERENCE_CORES)
+            # Decode a second of silence through the same batched path run() uses, so the
+            # fixed 30 s encoder input and batch decoder are set up before the first window
+            silence = np.zeros(SAMPLE_RATE, dtype=np.float32)
+            segments, _ = _get_pipeline(self.model_name).transcribe(
+                silence,
+                beam_size=1,
+                clip_timestamps=[{"start": 0.0, "end": len(silence) / SAMPLE_RATE}],
+                batch_size=1
+            )
+            list(segments)
+            self.ready_signal.emit()
+        except Exception as e:
+            self.error_signal.emit(f"Error loading model: {str(e)}")
 
 class TranscriptionThread(QThread):
     transcription_signal = pyqtSignal(str)
@@ -15,61 +93,114 @@ class TranscriptionThread(QThread):
     def __init__(self):
         super().__init__()
         self.running = False
-        self.model = whisper.load_model("base")
-        self.p = pyaudio.PyAudio()
+        self.model_name = "base.en"  # English-only models skip language detection
         self.selected_device_index = None
+        self._devices_cache = None
         self.audio_queue = queue.Queue()
         self.CHUNK_SIZE = 1024 * 32  # Larger chunk size for better processing
-        self.SAMPLE_RATE = 16000
+        self.SAMPLE_RATE = SAMPLE_RATE
         self.CHANNELS = 1
-        self.SILENCE_THRESHOLD = 0.005
+        self.vad_options = VadOptions(threshold=0.5)  # Silero VAD speech probability threshold
         self.MIN_PHRASE_LENGTH = 10  # Minimum length for a phrase to be considered valid
+        self.DUPLICATE_SIMILARITY = 0.8  # Word-set overlap above which a phrase counts as a repeat
         self.buffer_size_seconds = 10  # Default buffer size in seconds
+        self.BATCH_MAX = 8  # Maximum number of speech segments per inference call
+        self.CARRYOVER_SAMPLES = self.SAMPLE_RATE // 5  # Audio shared by consecutive windows
+        
+        # The audio callback writes int16 samples straight into this ring and only
+        # queues (offset, length) pairs for the transcription loop
+        self._ring = np.empty(self.SAMPLE_RATE * 60, dtype=np.int16)
+        self._write_pos = 0
+        self._callback_prioritized = False
+        
+    def get_available_devices(self, force=False):
+        # Enumerating PortAudio devices is slow; reuse the last scan unless a refresh is forced
+        if self._devices_cache is not None and not force:
+            return self._devices_cache
+        
+        if force:
+            # PortAudio only scans devices when it initializes, so restart it to pick up
+            # newly connected hardware; callers only force this while no stream is open
+            sd._terminate()
+            sd._initialize()
         
-    def get_available_devices(self):
         devices = []
-        for i in range(self.p.get_device_count()):
-            dev = self.p.get_device_info_by_index(i)
-            if dev['maxInputChannels'] > 0:  # Only include input devices
+        for i, dev in enumerate(sd.query_devices()):
+            if dev['max_input_channels'] > 0:  # Only include input devices
                 name = dev['name']
                 if 'CABLE Output' in name:
                     name = f"{name} (Virtual Cable)"
                 else:
                     name = f"{name} (Microphone)"
                 devices.append((name, i))
+        self._devices_cache = devices
         return devices
 
     def set_device(self, device_index):
         self.selected_device_index = device_index
 
+    def set_model(self, model_name):
+        self.model_name = model_name
+
     def set_buffer_size(self, seconds):
         self.buffer_size_seconds = max(5, min(30, seconds))  # Limit between 5 and 30 seconds
 
-    def audio_callback(self, in_data, frame_count, time_info, status):
-        self.audio_queue.put(in_data)
-        return (None, pyaudio.paContinue)
+    def audio_callback(self, indata, frames, time_info, status):
+        if not self._callback_prioritized:
+            # First call on a fresh PortAudio callback thread, which inherited the
+            # transcription thread's affinity; move it back onto the audio cores
+            _pin_to_cores(_AUDIO_CORES)
+            _raise_thread_priority()
+            self._callback_prioritized = True
+        
+        samples = indata[:, 0]
+        start = self._write_pos
+        end = start + len(samples)
+        if end <= self._ring.size:
+            self._ring[start:end] = samples
+        else:
+            split = self._ring.size - start
+            self._ring[start:] = samples[:split]
+            self._ring[:end - self._ring.size] = samples[split:]
+        self.audio_queue.put((start, len(samples)))
+        self._write_pos = end % self._ring.size
 
-    def is_silence(self, audio_data, threshold_multiplier=1.0):
-        return np.max(np.abs(audio_data)) < (self.SILENCE_THRESHOLD * threshold_multiplier)
+    def ring_view(self, start, length):
+        """Contiguous view of ring samples, copying only when the span wraps around"""
+        end = start + length
+        if end <= self._ring.size:
+            return self._ring[start:end]
+        return np.concatenate([self._ring[start:], self._ring[:end - self._ring.size]])
 
-    def find_speech_boundaries(self, audio_data):
-        """Find the boundaries of speech in the audio data"""
-        window_size = 1024
-        energy = np.array([
-            np.mean(np.abs(audio_data[i:i+window_size]))
-            for i in range(0, len(audio_data)-window_size, window_size)
-        ])
+    def transcribe_batch(self, audio, segment_lengths, initial_prompt=None):
+        """Transcribe back-to-back speech segments in a single batched inference call"""
+        if not segment_lengths:
+            return []
         
-        threshold = np.mean(energy) * 0.5
-        speech_regions = energy > threshold
+        # Describe each segment as a clip; every clip is padded to the
+        # same 30 s mel input, so they batch cleanly
+        clip_ends = np.cumsum(segment_lengths)
+        clip_starts = np.concatenate([[0], clip_ends[:-1]])
+        clips = [
+            {"start": start / self.SAMPLE_RATE, "end": end / self.SAMPLE_RATE}
+            for start, end in zip(clip_starts, clip_ends)
+        ]
         
-        if not any(speech_regions):
-            return 0, len(audio_data)
-            
-        start = np.where(speech_regions)[0][0] * window_size
-        end = (np.where(speech_regions)[0][-1] + 1) * window_size
+        segments, _ = _get_pipeline(self.model_name).transcribe(
+            audio,
+            beam_size=1,
+            initial_prompt=initial_prompt,
+            clip_timestamps=clips,
+            batch_size=len(segment_lengths)
+        )
         
-        return max(0, start), min(len(audio_data), end)
+        # Map each decoded segment back to the clip it came from
+        texts = [""] * len(segment_lengths)
+        for segment in segments:
+            midpoint = (segment.start + segment.end) / 2 * self.SAMPLE_RATE
+            index = min(int(np.searchsorted(clip_ends, midpoint)), len(texts) - 1)
+            texts[index] += segment.text
+        return [text.strip() for text in texts]
 
     def run(self):
         if self.selected_device_index is None:
@@ -77,69 +208,129 @@ class TranscriptionThread(QThread):
             return
 
         try:
-            stream = self.p.open(
-                format=pyaudio.paFloat32,
+            _pin_to_cores(_INFERENCE_CORES)
+            self._write_pos = 0
+            self._callback_prioritized = False
+            stream = sd.InputStream(
+                samplerate=self.SAMPLE_RATE,
                 channels=self.CHANNELS,
-                rate=self.SAMPLE_RATE,
-                input=True,
-                frames_per_buffer=self.CHUNK_SIZE,
-                input_device_index=self.selected_device_index,
-                stream_callback=self.audio_callback
+                dtype='int16',
+                blocksize=self.CHUNK_SIZE,
+                device=self.selected_device_index,
+                latency='low',
+                callback=self.audio_callback
             )
             
-            stream.start_stream()
+            stream.start()
             self.running = True
             
-            audio_buffer = np.array([], dtype=np.float32)
+            # Unprocessed audio is the ring span starting at read_pos
+            read_pos = 0
+            buffered_samples = 0
             MIN_SAMPLES = int(self.SAMPLE_RATE * self.buffer_size_seconds)
+            # Leave the callback room to write while older audio is still being read
+            MAX_BUFFERED = self._ring.size - 2 * self.CHUNK_SIZE
+            # Normalized speech for a whole batch is written here, reused across cycles
+            batch_audio = np.empty(self.BATCH_MAX * MIN_SAMPLES, dtype=np.float32)
+            # Float copy of the current window for the VAD, which needs samples in [-1, 1]
+            window_f32 = np.empty(MIN_SAMPLES, dtype=np.float32)
             silence_duration = 0
+            recent_tokens = deque(maxlen=3)  # Word sets of the last few emitted phrases
             last_transcription = ""
             
             while self.running:
-                # Collect audio data from queue
-                while not self.audio_queue.empty():
-                    data = self.audio_queue.get()
-                    audio_chunk = np.frombuffer(data, dtype=np.float32)
-                    audio_buffer = np.concatenate([audio_buffer, audio_chunk])
+                # Block until audio arrives, waking periodically to check self.running
+                try:
+                    _, length = self.audio_queue.get(timeout=0.25)
+                except queue.Empty:
+                    continue
+                buffered_samples += length
+                
+                # Collect whatever else is already queued
+                while True:
+                    try:
+                        _, length = self.audio_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    buffered_samples += length
+                
+                # If inference fell too far behind, the oldest audio is being overwritten
+                if buffered_samples > MAX_BUFFERED:
+                    dropped = buffered_samples - MAX_BUFFERED
+                    read_pos = (read_pos + dropped) % self._ring.size
+                    buffered_samples -= dropped
                 
                 # Process when we have enough data
-                if len(audio_buffer) >= MIN_SAMPLES:
-                    # Find speech boundaries in the buffer
-                    start, end = self.find_speech_boundaries(audio_buffer[:MIN_SAMPLES])
+                if buffered_samples >= MIN_SAMPLES:
+                    audio_buffer = self.ring_view(read_pos, buffered_samples)
                     
-                    if end - start > self.SAMPLE_RATE:  # At least 1 second of speech
-                        # Extract speech segment
-                        speech_segment = audio_buffer[start:end]
+                    # Cut every complete window already buffered; if inference
+                    # falls behind real time, the backlog is transcribed as one batch
+                    segment_lengths = []
+                    batch_len = 0
+                    offset = 0
+                    while (len(audio_buffer) - offset >= MIN_SAMPLES
+                           and len(segment_lengths) < self.BATCH_MAX):
+                        window = audio_buffer[offset:offset + MIN_SAMPLES]
                         
-                        # Normalize audio
-                        max_val = np.max(np.abs(speech_segment))
-                        if max_val > 0:
-                            speech_segment = speech_segment / max_val
+                        # Detect speech with Silero VAD; pure noise never reaches Whisper
+                        np.multiply(window, 1.0 / 32768, out=window_f32)
+                        speech_timestamps = get_speech_timestamps(window_f32, self.vad_options)
+                        speech_samples = sum(ts['end'] - ts['start'] for ts in speech_timestamps)
                         
-                        # Add padding for better sentence detection
-                        padded_audio = np.pad(speech_segment, (0, self.SAMPLE_RATE), mode='constant')
-                        
-                        # Transcribe
-                        result = self.model.transcribe(padded_audio, language='en', fp16=False)
-                        transcript = result['text'].strip()
+                        if speech_samples > self.SAMPLE_RATE:  # At least 1 second of speech
+                            spans = [window[ts['start']:ts['end']] for ts in speech_timestamps]
+                            
+                            # Normalize audio straight from int16, joining the spans into the
+                            # batch buffer in the same pass
+                            # Widen to int32 so a -32768 sample doesn't wrap around in abs
+                            max_val = max(np.abs(span, dtype=np.int32).max() for span in spans)
+                            scale = 1.0 / max_val if max_val > 0 else 1.0
+                            for span in spans:
+                                np.multiply(span, scale, out=batch_audio[batch_len:batch_len + len(span)])
+                                batch_len += len(span)
+                            
+                            segment_lengths.append(speech_samples)
                         
+                        # Only a short carryover is encoded twice; earlier context
+                        # reaches the decoder through the text prompt instead
+                        offset += MIN_SAMPLES - self.CARRYOVER_SAMPLES
+                    
+                    # Transcribe (CTranslate2 pads the mel spectrogram internally).
+                    # The pipeline applies one prompt to every clip in a batch, so it's
+                    # only used for a single window; later windows of a backlog would
+                    # otherwise be steered by text from before the first one
+                    initial_prompt = None
+                    if len(segment_lengths) == 1:
+                        initial_prompt = last_transcription[-200:] or None
+                    transcripts = self.transcribe_batch(
+                        batch_audio[:batch_len],
+                        segment_lengths,
+                        initial_prompt=initial_prompt
+                    )
+                    for transcript in transcripts:
                         # Only emit if we have meaningful text
                         if transcript and len(transcript) > self.MIN_PHRASE_LENGTH:
                             # Avoid duplicate transcriptions
-                            if transcript.lower() not in last_transcription.lower():
+                            tokens = frozenset(transcript.lower().split())
+                            if not any(
+                                len(tokens & previous) / max(len(tokens | previous), 1)
+                                > self.DUPLICATE_SIMILARITY
+                                for previous in recent_tokens
+                            ):
                                 self.transcription_signal.emit(transcript)
+                                recent_tokens.append(tokens)
                                 last_transcription = transcript
                     
-                    # Keep a portion of the buffer for context
-                    audio_buffer = audio_buffer[MIN_SAMPLES - self.SAMPLE_RATE:]
-                
-                time.sleep(0.1)
+                    # Drop processed audio, keeping the context tail
+                    read_pos = (read_pos + offset) % self._ring.size
+                    buffered_samples -= offset
                 
         except Exception as e:
             self.error_signal.emit(f"Error during transcription: {str(e)}")
         finally:
             if 'stream' in locals():
-                stream.stop_stream()
+                stream.stop()
                 stream.close()
             self.audio_queue.queue.clear()
 
@@ -169,6 +360,20 @@ class TranscriptionApp(QMainWindow):
         self.device_combo = QComboBox()
         layout.addWidget(self.device_combo)
         
+        self.refresh_button = QPushButton("Refresh Devices")
+        self.refresh_button.clicked.connect(self.refresh_devices)
+        layout.addWidget(self.refresh_button)
+        
+        # Create model selection dropdown
+        self.model_label = QLabel("Whisper Model:")
+        layout.addWidget(self.model_label)
+        
+        self.model_combo = QComboBox()
+        self.model_combo.addItems(["tiny.en", "base.en", "small.en"])
+        self.model_combo.setCurrentText(self.transcription_thread.model_name)
+        self.model_combo.currentTextChanged.connect(self.on_model_changed)
+        layout.addWidget(self.model_combo)
+        
         # Create buffer size control
         buffer_layout = QVBoxLayout()
         self.buffer_label = QLabel("Buffer Size (seconds):")
@@ -198,12 +403,52 @@ class TranscriptionApp(QMainWindow):
         self.toggle_button.clicked.connect(self.toggle_transcription)
         layout.addWidget(self.toggle_button)
         
+        # Create retry button, only shown when the model fails to load
+        self.retry_button = QPushButton("Retry Loading Model")
+        self.retry_button.clicked.connect(self.start_model_warmup)
+        self.retry_button.hide()
+        layout.addWidget(self.retry_button)
+        
         # Create text display area
-        self.text_display = QTextEdit()
+        self.text_display = QPlainTextEdit()
         self.text_display.setReadOnly(True)
+        self.text_display.document().setUndoRedoEnabled(False)
+        self.text_display.setMaximumBlockCount(2000)  # Oldest lines are trimmed in long meetings
         layout.addWidget(self.text_display)
         
         self.is_transcribing = False
+        
+        # Transcripts arriving close together are written to the display in one go
+        self._pending = []
+        self._flush_scheduled = False
+        
+        self.start_model_warmup()
+
+    def start_model_warmup(self):
+        # Load and warm up the model in the background; Start is enabled once it's ready
+        self.toggle_button.setEnabled(False)
+        self.model_combo.setEnabled(False)
+        self.retry_button.hide()
+        self.status_label.setText(f"Status: Loading model {self.transcription_thread.model_name}...")
+        self.warmup_thread = ModelWarmupThread(self.transcription_thread.model_name)
+        self.warmup_thread.ready_signal.connect(self.on_model_ready)
+        self.warmup_thread.error_signal.connect(self.on_model_error)
+        self.warmup_thread.start()
+
+    def on_model_ready(self):
+        self.toggle_button.setEnabled(True)
+        self.model_combo.setEnabled(True)
+        self.status_label.setText("Status: Ready")
+
+    def on_model_error(self, error_message):
+        # Keep the error visible and let the user retry or pick another model
+        self.status_label.setText(f"Status: Error - {error_message}")
+        self.model_combo.setEnabled(True)
+        self.retry_button.show()
+
+    def on_model_changed(self, model_name):
+        self.transcription_thread.set_model(model_name)
+        self.start_model_warmup()
 
     def on_buffer_size_changed(self, value):
         self.transcription_thread.set_buffer_size(value)
@@ -212,9 +457,13 @@ class TranscriptionApp(QMainWindow):
     def clear_text(self):
         self.text_display.clear()
 
-    def populate_device_list(self):
+    def refresh_devices(self):
+        self.populate_device_list(force=True)
+        self.status_label.setText("Status: Device list refreshed")
+
+    def populate_device_list(self, force=False):
         self.device_combo.clear()
-        devices = self.transcription_thread.get_available_devices()
+        devices = self.transcription_thread.get_available_devices(force=force)
         for name, _ in devices:
             self.device_combo.addItem(name)
         
@@ -246,6 +495,8 @@ class TranscriptionApp(QMainWindow):
         self.toggle_button.setText("Stop Transcription")
         self.status_label.setText(f"Status: Transcribing using {self.device_combo.currentText()}...")
         self.device_combo.setEnabled(False)
+        self.refresh_button.setEnabled(False)
+        self.model_combo.setEnabled(False)
         self.buffer_spin.setEnabled(False)
         self.transcription_thread.start()
 
@@ -254,12 +505,22 @@ class TranscriptionApp(QMainWindow):
         self.toggle_button.setText("Start Transcription")
         self.status_label.setText("Status: Stopped")
         self.device_combo.setEnabled(True)
+        self.refresh_button.setEnabled(True)
+        self.model_combo.setEnabled(True)
         self.buffer_spin.setEnabled(True)
         self.transcription_thread.stop()
         self.transcription_thread.wait()
 
     def update_transcription(self, text):
-        self.text_display.append(text)
+        self._pending.append(text)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            QTimer.singleShot(50, self._flush_transcriptions)
+
+    def _flush_transcriptions(self):
+        self.text_display.appendPlainText("\n".join(self._pending))
+        self._pending.clear()
+        self._flush_scheduled = False
         # Auto-scroll to bottom
         scrollbar = self.text_display.verticalScrollBar()
         scrollbar.setValue(scrollbar.maximum())
@@ -270,6 +531,13 @@ class TranscriptionApp(QMainWindow):
 
     def closeEvent(self, event):
         self.stop_transcription()
+        if self.warmup_thread.isRunning():
+            # A model download/warm-up can't be interrupted; hide the window now
+            # and finish closing once the thread is done instead of blocking here
+            self.hide()
+            self.warmup_thread.finished.connect(self.close)
+            event.ignore()
+            return
         event.accept()
 
 if __name__ == '__main__':